@@ -10,9 +10,16 @@ import shutil
 import tempfile
 import json
 import random
+import math
 import uuid
 import subprocess
 import asyncio
+import sys
+import time
+import io
+import numpy as np
+from PIL import Image
+from collections import OrderedDict
 
 # Load configuration
 with open('config.json') as f:
@@ -22,11 +29,31 @@ bot_token = config['bot_token']
 messages = config['messages']
 MAX_FILE_SIZE_MB = 25
 SUPPORTED_FILE_TYPES = ['mp4', 'mov', 'webm', 'png', 'jpg']
-
-# Set up bot with command prefix &ovb and cooldowns
-intents = discord.Intents.default()
+MAX_REPEAT_SECONDS = 600
+
+# Sharding: leave shard_count/shard_ids unset to let discord.py pick them,
+# or set them per process to split shards across processes and hosts
+SHARD_COUNT = config.get('shard_count')
+SHARD_IDS = config.get('shard_ids')
+
+# Only ask for what the commands use: guild/DM messages and their content (attachments)
+intents = discord.Intents.none()
+intents.guilds = True
+intents.guild_messages = True
+intents.dm_messages = True
 intents.message_content = True
-bot = commands.Bot(command_prefix='&ovb ', intents=intents)
+
+# Set up bot with command prefix &ovb
+# Member caching and the message cache are disabled, replies are fetched from the API on demand
+bot = commands.AutoShardedBot(
+    command_prefix='&ovb ',
+    intents=intents,
+    shard_count=SHARD_COUNT,
+    shard_ids=SHARD_IDS,
+    member_cache_flags=discord.MemberCacheFlags.none(),
+    max_messages=config.get('max_messages'),
+    chunk_guilds_at_startup=False,
+)
 
 # Helper function to create a temp directory in the bot's root folder
 def create_temp_dir():
@@ -48,6 +75,201 @@ def cleanup_temp_dir(temp_dir):
     if os.path.exists(temp_dir):
         shutil.rmtree(temp_dir)
 
+# Local store of recent bot outputs, so replying to the bot's own output with another
+# command reuses the file we just encoded instead of downloading it again from Discord
+RETAINED_OUTPUTS_MAX_BYTES = config.get('retained_outputs_mb', 512) * 1024 * 1024
+# Each process gets its own directory so shard processes on one host don't clear each other's outputs,
+# processes running fixed shards reuse (and clean up) the same directory across restarts
+RETAINED_OUTPUTS_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tmp', 'retained')
+RETAINED_OUTPUTS_DIR = os.path.join(
+    RETAINED_OUTPUTS_ROOT,
+    f"shards_{'_'.join(str(shard_id) for shard_id in SHARD_IDS)}" if SHARD_IDS else f'pid_{os.getpid()}'
+)
+retained_outputs = OrderedDict()  # attachment id -> RetainedOutput, oldest first
+retained_message_ids = {}  # message id -> id of its first attachment
+retained_outputs_bytes = 0
+
+def is_process_alive(pid):
+    """Checks whether a process with the given PID is still running."""
+    if sys.platform == 'win32':
+        # os.kill(pid, 0) would send CTRL_C_EVENT on Windows, ask the kernel instead
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def cleanup_stale_retained_dirs():
+    """Removes pid_* store directories left behind by processes that are no longer running."""
+    if not os.path.isdir(RETAINED_OUTPUTS_ROOT):
+        return
+    for name in os.listdir(RETAINED_OUTPUTS_ROOT):
+        if not name.startswith('pid_'):
+            continue
+        try:
+            pid = int(name[len('pid_'):])
+        except ValueError:
+            continue
+        if pid != os.getpid() and not is_process_alive(pid):
+            shutil.rmtree(os.path.join(RETAINED_OUTPUTS_ROOT, name), ignore_errors=True)
+
+# The index only lives in memory, so files this process left over in a previous run are useless.
+# Sibling processes' directories are left alone unless their process has exited.
+shutil.rmtree(RETAINED_OUTPUTS_DIR, ignore_errors=True)
+cleanup_stale_retained_dirs()
+os.makedirs(RETAINED_OUTPUTS_DIR, exist_ok=True)
+
+def read_file_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def write_file_bytes(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+class RetainedOutput:
+    """A locally stored bot output that can stand in for a discord.Attachment."""
+
+    def __init__(self, message_id, attachment_id, filename, path, size):
+        self.message_id = message_id
+        self.id = attachment_id
+        self.filename = filename
+        self.path = path
+        self.size = size
+
+    async def save(self, fp):
+        await asyncio.to_thread(shutil.copyfile, self.path, fp)
+
+    async def read(self):
+        return await asyncio.to_thread(read_file_bytes, self.path)
+
+def evict_retained_output(retained):
+    """Removes a retained output from the index and from disk."""
+    global retained_outputs_bytes
+
+    retained_outputs.pop(retained.id, None)
+    if retained_message_ids.get(retained.message_id) == retained.id:
+        del retained_message_ids[retained.message_id]
+    retained_outputs_bytes -= retained.size
+    if os.path.exists(retained.path):
+        os.remove(retained.path)
+
+async def retain_output(message, outputs):
+    """Stores the outputs (paths or in-memory bytes) posted in message, evicting the oldest outputs past the byte limit."""
+    global retained_outputs_bytes
+
+    # An edited message replaces whatever was retained for it before
+    previous = retained_outputs.get(retained_message_ids.pop(message.id, None))
+    if previous is not None:
+        evict_retained_output(previous)
+
+    for attachment, output in zip(message.attachments, outputs):
+        if attachment.size > RETAINED_OUTPUTS_MAX_BYTES:
+            continue
+
+        path = os.path.join(RETAINED_OUTPUTS_DIR, f'{message.id}_{attachment.id}_{attachment.filename}')
+        # Retention is best effort, the output has already been posted
+        try:
+            if isinstance(output, bytes):
+                await asyncio.to_thread(write_file_bytes, path, output)
+            else:
+                await asyncio.to_thread(shutil.copyfile, output, path)
+        except Exception as e:
+            print(f"retention error: {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+
+        # The index is only touched from the event loop, so no locking is needed
+        retained_outputs[attachment.id] = RetainedOutput(message.id, attachment.id, attachment.filename, path, attachment.size)
+        retained_message_ids.setdefault(message.id, attachment.id)
+        retained_outputs_bytes += attachment.size
+
+    while retained_outputs_bytes > RETAINED_OUTPUTS_MAX_BYTES:
+        evict_retained_output(next(iter(retained_outputs.values())))
+
+def get_retained_output(message_id=None, attachment_id=None):
+    """Looks up a retained output by the message it was posted in or by its attachment ID."""
+    if attachment_id is None:
+        attachment_id = retained_message_ids.get(message_id)
+    retained = retained_outputs.get(attachment_id)
+    if retained is None or not os.path.exists(retained.path):
+        return None
+    # Recently used outputs are the last to be evicted
+    retained_outputs.move_to_end(attachment_id)
+    return retained
+
+async def reply_with_output(ctx, content, output, filename=None, preview=False):
+    """
+    Replies with one or more output files and keeps a local copy of them.
+
+    :param output: A path or in-memory buffer, or a list of (path or buffer, filename) tuples to post together.
+    :param filename: Filename to upload a single output under, defaults to the file's own name.
+    :param preview: Whether this is only a preview, so the job doesn't count as done yet.
+    """
+    outputs = output if isinstance(output, list) else [(output, filename)]
+
+    files = []
+    retained = []
+    for source, source_filename in outputs:
+        files.append(discord.File(source, filename=source_filename))
+        # discord.py closes buffers after sending, so grab the bytes first
+        retained.append(source.getvalue() if isinstance(source, io.BytesIO) else source)
+
+    message = await ctx.reply(content, files=files)
+    if not preview:
+        ctx.output_posted = True
+    await retain_output(message, retained)
+    return message
+
+def get_process_rss_mb():
+    """Returns (resident memory of this process in MB, whether it's the current or the peak value), or (None, None)."""
+    # Linux exposes current RSS in pages as the second field of /proc/self/statm
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 'current'
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        # The resource module doesn't exist on Windows
+        return None, None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return (rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024), 'peak'
+
+def get_shard_memory_report():
+    """Builds a memory/cache report line for every shard running in this process."""
+    rss, kind = get_process_rss_mb()
+    rss_text = f"{rss:.1f} MB ({kind})" if rss is not None else "unavailable"
+    lines = [f"RSS: {rss_text} | shards in process: {len(bot.shards)}/{bot.shard_count}"]
+    for shard_id, shard in sorted(bot.shards.items()):
+        guilds = [g for g in bot.guilds if g.shard_id == shard_id]
+        members = sum(len(g.members) for g in guilds)
+        channels = sum(len(g.channels) for g in guilds)
+        lines.append(
+            f"Shard {shard_id}: guilds={len(guilds)} channels={channels} cached_members={members} "
+            f"latency={round(shard.latency * 1000)}ms"
+        )
+    lines.append(f"Cached users: {len(bot.users)} | cached messages: {len(bot.cached_messages)}")
+    return "\n".join(lines)
+
 def get_random_message():
     return random.choice(config['messages'])
 
@@ -64,6 +286,15 @@ def parse_params(message_content):
     
     return params
 
+def parse_effects(message_content):
+    """Extracts param=value pairs in the order given, keeping repeats, as a list of (name, value) tuples."""
+    effects = []
+    for part in message_content.split():
+        if '=' in part:
+            key, value = part.split('=', 1)
+            effects.append((key.lower(), value))
+    return effects
+
 def get_video_duration(filepath):
     """Returns the duration of the video in seconds."""
     probe = ffmpeg.probe(filepath)
@@ -92,6 +323,177 @@ def generate_random_sections(duration, num_sections, min_duration=None, max_dura
         sections.append((start, end))
     return sections
 
+def loop_to_length(unit_path, seconds, output_path):
+    """
+    Builds an output of the given length by repeating an already encoded unit with stream copy.
+
+    :param unit_path: Path to the encoded base unit (one loop iteration or a short still GOP).
+    :param seconds: Length of the final output in seconds.
+    :param output_path: Where to write the final output.
+    """
+    unit_duration = get_video_duration(unit_path)
+    # stream_loop counts the extra plays after the first one
+    loops = max(0, math.ceil(seconds / unit_duration) - 1)
+
+    # The unit is demuxed again for every loop but never decoded
+    ffmpeg.input(unit_path, stream_loop=loops).output(output_path, c='copy', t=seconds).run(quiet=True, overwrite_output=True)
+
+# In-process image engine: images are decoded once into a NumPy array,
+# effects run as vectorized ops and the result is encoded straight to memory
+IMAGE_FILE_TYPES = ('.png', '.jpg', '.jpeg')
+
+# Full-range BT.601 RGB <-> YCbCr, both chroma axes on the same 0.5 scale like the
+# Cb/Cr planes ffmpeg's hue filter rotates, so images and videos come out the same
+RGB_TO_YCBCR = np.array([
+    [0.299, 0.587, 0.114],
+    [-0.168736, -0.331264, 0.5],
+    [0.5, -0.418688, -0.081312],
+], dtype=np.float32)
+YCBCR_TO_RGB = np.linalg.inv(RGB_TO_YCBCR).astype(np.float32)
+
+def is_image(filename):
+    return filename.lower().endswith(IMAGE_FILE_TYPES)
+
+def hue_image(pixels, hue_value):
+    """Rotates the hue of an RGB float array by hue_value degrees."""
+    angle = math.radians(hue_value)
+    cos, sin = math.cos(angle), math.sin(angle)
+    rotation = np.array([
+        [1, 0, 0],
+        [0, cos, -sin],
+        [0, sin, cos],
+    ], dtype=np.float32)
+    # Fold the whole conversion into one 3x3 matrix so it's a single matmul over all pixels
+    matrix = YCBCR_TO_RGB @ rotation @ RGB_TO_YCBCR
+    return pixels @ matrix.T
+
+def quality_image(pixels, quality):
+    """Makes the image look worse (1 being best, 100 being worst) by downscaling and posterizing."""
+    quality = max(1, min(quality, 100))
+    height, width = pixels.shape[:2]
+
+    # Downscale by averaging blocks, then scale back up by repeating pixels
+    block = 1 + int((quality - 1) / 99 * 7)
+    if block > 1:
+        cropped_h, cropped_w = height - height % block, width - width % block
+        if cropped_h and cropped_w:
+            small = pixels[:cropped_h, :cropped_w].reshape(cropped_h // block, block, cropped_w // block, block, 3).mean(axis=(1, 3))
+            pixels = pixels.copy()
+            pixels[:cropped_h, :cropped_w] = small.repeat(block, axis=0).repeat(block, axis=1)
+
+    # Reduce the number of colour levels per channel
+    levels = max(2, int(256 - (quality - 1) / 99 * 248))
+    step = 255 / (levels - 1)
+    return np.round(pixels / step) * step
+
+IMAGE_EFFECTS = {
+    'hue': hue_image,
+    'quality': quality_image,
+}
+
+def decode_image(image_bytes):
+    """Decodes PNG/JPG bytes into an RGB float array and its alpha channel (None for opaque images)."""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        if not image.has_transparency_data:
+            return np.asarray(image.convert('RGB'), dtype=np.float32), None
+        rgba = np.asarray(image.convert('RGBA'))
+    return rgba[..., :3].astype(np.float32), rgba[..., 3]
+
+def render_image(pixels, alpha, effects, output_format='PNG'):
+    """
+    Runs a chain of image effects on decoded pixels and encodes the result to an in-memory buffer.
+
+    :param pixels: RGB float array from decode_image.
+    :param alpha: Alpha channel from decode_image, or None. Effects only touch the colour channels.
+    :param effects: List of (effect name, value) tuples, applied in order.
+    :param output_format: Pillow format name to encode to (PNG, JPEG or GIF).
+    :return: BytesIO with the encoded image, positioned at the start.
+    """
+    for name, value in effects:
+        pixels = IMAGE_EFFECTS[name](pixels, value)
+
+    if alpha is not None and output_format == 'JPEG':
+        # JPEG has no transparency, flatten onto white
+        coverage = alpha[..., np.newaxis] / 255
+        pixels = pixels * coverage + 255 * (1 - coverage)
+        alpha = None
+
+    rgb = np.clip(pixels, 0, 255).astype(np.uint8)
+    if alpha is None:
+        result = Image.fromarray(rgb, 'RGB')
+    else:
+        result = Image.fromarray(np.dstack((rgb, alpha)), 'RGBA')
+
+    buffer = io.BytesIO()
+    save_kwargs = {}
+    if output_format == 'JPEG':
+        # Lower the JPEG quality along with the quality effect so the encode degrades too
+        worst = max((value for name, value in effects if name == 'quality'), default=1)
+        save_kwargs['quality'] = max(1, 95 - int(worst * 0.94))
+    result.save(buffer, format=output_format, **save_kwargs)
+    buffer.seek(0)
+    return buffer
+
+def apply_image_effects(image_bytes, effects, output_format='PNG'):
+    """Decodes an image, runs a chain of effects on it and encodes the result to an in-memory buffer."""
+    pixels, alpha = decode_image(image_bytes)
+    return render_image(pixels, alpha, effects, output_format)
+
+def apply_image_effects_fanout(image_bytes, renders):
+    """Decodes an image once and renders it several ways, renders is a list of (effects, output format)."""
+    pixels, alpha = decode_image(image_bytes)
+    return [render_image(pixels, alpha, effects, output_format) for effects, output_format in renders]
+
+# Fan-out: one ffmpeg run decodes the input once, splits the video and encodes several outputs
+FANOUT_MAX_OUTPUTS = 4
+TOGIF_EXTRA_FORMATS = ('mp4',)
+
+def split_postable_outputs(outputs, get_size=os.path.getsize):
+    """
+    Splits outputs into the ones that fit in a single upload and the ones that don't.
+
+    :param outputs: Output paths (or buffers, with a matching get_size) in order of preference.
+    :param get_size: Function returning the size of an output in bytes.
+    :return: (outputs to post, outputs left out), each file and their total stay under MAX_FILE_SIZE_MB.
+    """
+    limit = MAX_FILE_SIZE_MB * 1024 * 1024
+    postable, skipped = [], []
+    total = 0
+    for output in outputs:
+        size = get_size(output)
+        if total + size > limit:
+            skipped.append(output)
+        else:
+            postable.append(output)
+            total += size
+    return postable, skipped
+
+def build_fanout_command(input_path, outputs, video_filter=None):
+    """
+    Builds an ffmpeg command that decodes the input once and encodes several outputs from it.
+
+    :param input_path: Path to the input video.
+    :param outputs: List of (output path, video filter for this output or None, extra ffmpeg args, keep audio) tuples.
+    :param video_filter: Filter applied once to the decoded video before it's split, or None.
+    :return: The ffmpeg command as a list of arguments.
+    """
+    labels = "".join(f"[v{i}]" for i in range(len(outputs)))
+    filter_complex = f"[0:v]{video_filter + ',' if video_filter else ''}split={len(outputs)}{labels}"
+
+    output_args = []
+    for i, (output_path, output_filter, extra_args, keep_audio) in enumerate(outputs):
+        label = f"[v{i}]"
+        if output_filter:
+            filter_complex += f"; [v{i}]{output_filter}[o{i}]"
+            label = f"[o{i}]"
+        output_args += ["-map", label]
+        if keep_audio:
+            # The audio stream is decoded once too and fed to every output that wants it
+            output_args += ["-map", "0:a?"]
+        output_args += extra_args + [output_path]
+
+    return ["ffmpeg", "-y", "-i", input_path, "-filter_complex", filter_complex] + output_args
+
 # Create a decorator that adds typing indicator to commands
 def with_typing():
     def decorator(func):
@@ -104,8 +506,19 @@ def with_typing():
 
 async def get_video_or_image_from_message_or_history(ctx):
     """Get video or image from the replied message or current message."""
+    # The lookup is done once per command and shared between admission control and the command
+    if not hasattr(ctx, 'source_attachment'):
+        ctx.source_attachment = await find_video_or_image(ctx)
+    return ctx.source_attachment
+
+async def find_video_or_image(ctx):
     # If the command is a reply, get the original message
     if ctx.message.reference:
+        # Replies to our own recent outputs resolve straight to the local copy
+        retained = get_retained_output(message_id=ctx.message.reference.message_id)
+        if retained is not None:
+            return retained
+
         referenced_message = await ctx.channel.fetch_message(ctx.message.reference.message_id)
         if referenced_message.attachments:
             return referenced_message.attachments[0]
@@ -117,14 +530,417 @@ async def get_video_or_image_from_message_or_history(ctx):
     # Retrieve messages in the channel
     async for message in ctx.channel.history(limit=10):
         if message.attachments:
-            return message.attachments[0]
+            return get_retained_output(attachment_id=message.attachments[0].id) or message.attachments[0]
     
     return None
 
+# Admission control: instead of a flat cooldown, every job is priced in estimated
+# encode-seconds (wall-clock seconds spent encoding) from probe metadata and command type,
+# and paid for out of token buckets
+COST_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cost_model.json')
+MAX_JOB_MEMORY_MB = config.get('max_job_memory_mb', 2048)
+
+# Encode-seconds per megapixel-frame of input, calibrated from measured encode times as jobs finish
+DEFAULT_COMMAND_COSTS = {
+    'reverse': 0.015,
+    'speed': 0.01,
+    'pitch': 0.01,
+    'quality': 0.01,
+    'volume': 0.01,
+    'fps': 0.01,
+    'repu': 0.01,
+    'hue': 0.01,
+    'tovid': 0.01,
+    'togif': 0.02,
+    'ytp': 0.012,
+    'stutter': 0.012,
+    'edit': 0.01,
+}
+
+# Commands that don't work on an attachment are priced at a flat number of encode-seconds
+FIXED_COMMAND_COSTS = {
+    'download': 10.0,
+    'memory': 0.1,
+}
+
+# Commands whose filters hold every decoded frame in memory at once
+WHOLE_CLIP_IN_MEMORY = ('reverse', 'ytp')
+
+# Commands that run PNG/JPG attachments through the in-process image engine instead of ffmpeg
+IMAGE_ENGINE_COMMANDS = ('hue', 'quality', 'edit', 'togif')
+
+# (capacity, refill per second) in encode-seconds for each bucket scope
+BUCKET_LIMITS = {
+    'user': tuple(config.get('user_budget', [60, 0.5])),
+    'channel': tuple(config.get('channel_budget', [120, 1.0])),
+    'guild': tuple(config.get('guild_budget', [300, 2.0])),
+}
+
+def load_cost_model():
+    """Returns the saved per-command costs on top of the defaults, ignoring a missing or broken file."""
+    costs = dict(DEFAULT_COMMAND_COSTS)
+    try:
+        with open(COST_MODEL_PATH) as f:
+            saved = json.load(f)
+        costs.update({name: float(cost) for name, cost in saved.items() if name in DEFAULT_COMMAND_COSTS and float(cost) > 0})
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        print(f"cost model error: {e}, using defaults")
+    return costs
+
+def save_cost_model():
+    """Writes the costs to a temp file and swaps it in, so other shard processes never read a half-written file."""
+    temp_path = f'{COST_MODEL_PATH}.{os.getpid()}.tmp'
+    try:
+        with open(temp_path, 'w') as f:
+            json.dump(command_costs, f, indent=2)
+        os.replace(temp_path, COST_MODEL_PATH)
+    except OSError as e:
+        print(f"cost model error: {e}")
+
+command_costs = load_cost_model()
+
+token_buckets = {}  # (scope, id) -> TokenBucket
+BUCKET_PRUNE_INTERVAL_SECONDS = 60
+last_bucket_prune = time.monotonic()
+
+class TokenBucket:
+    """Holds up to capacity encode-seconds and refills at rate encode-seconds per second."""
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.in_flight = 0  # running jobs that still have to settle against this bucket
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost):
+        """Seconds until the bucket can pay for cost, 0 if it can right now."""
+        self.refill()
+        return max(0.0, (cost - self.tokens) / self.rate)
+
+def prune_buckets():
+    """Drops idle buckets that have refilled to capacity, a new bucket would start out the same."""
+    global last_bucket_prune
+
+    now = time.monotonic()
+    if now - last_bucket_prune < BUCKET_PRUNE_INTERVAL_SECONDS:
+        return
+    last_bucket_prune = now
+
+    for key, bucket in list(token_buckets.items()):
+        # Buckets with running jobs are kept, or the job would settle its cost on a bucket nobody uses
+        if bucket.in_flight:
+            continue
+        bucket.refill()
+        if bucket.tokens >= bucket.capacity:
+            del token_buckets[key]
+
+def get_buckets(ctx):
+    """Returns the user, channel and (outside DMs) guild buckets for a command."""
+    prune_buckets()
+
+    scopes = [('user', ctx.author.id), ('channel', ctx.channel.id)]
+    if ctx.guild is not None:
+        scopes.append(('guild', ctx.guild.id))
+
+    buckets = []
+    for scope, scope_id in scopes:
+        key = (scope, scope_id)
+        if key not in token_buckets:
+            token_buckets[key] = TokenBucket(*BUCKET_LIMITS[scope])
+        buckets.append((scope, token_buckets[key]))
+    return buckets
+
+def probe_media(source):
+    """Returns width, height, duration and fps of a file path or URL, images count as one frame."""
+    probe = ffmpeg.probe(source)
+    video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
+    if video_stream is None:
+        return {'width': 0, 'height': 0, 'duration': float(probe['format'].get('duration', 0)), 'fps': 0}
+
+    numerator, denominator = video_stream.get('avg_frame_rate', '0/0').split('/')
+    fps = float(numerator) / float(denominator) if float(denominator) else 0
+    duration = float(probe['format'].get('duration', 0) or 0)
+    return {
+        'width': int(video_stream.get('width', 0)),
+        'height': int(video_stream.get('height', 0)),
+        'duration': duration,
+        'fps': fps,
+    }
+
+def get_workload(media_info):
+    """Megapixel-frames in a probed file, the unit command costs are priced in."""
+    frames = max(1, media_info['duration'] * media_info['fps'])
+    return media_info['width'] * media_info['height'] * frames / 1_000_000
+
+def estimate_job(command_name, media_info):
+    """Estimates (encode-seconds, peak memory in MB) for running a command on a probed file."""
+    if command_name in FIXED_COMMAND_COSTS or media_info is None:
+        return FIXED_COMMAND_COSTS.get(command_name, 5.0), 0
+
+    cost_seconds = command_costs[command_name] * get_workload(media_info)
+
+    pixels = media_info['width'] * media_info['height']
+    if media_info.get('image') and command_name in IMAGE_ENGINE_COMMANDS:
+        # One RGB float32 frame plus about two temporaries of the same size from the effect ops,
+        # and the decoded/encoded 8-bit copies
+        memory_mb = 100 + pixels * (3 * 4 * 3 + 3 * 2) / (1024 * 1024)
+        return cost_seconds, memory_mb
+
+    # Decoded YUV420 frames are 1.5 bytes per pixel, x264 keeps around 60 frames of lookahead
+    frame_mb = pixels * 1.5 / (1024 * 1024)
+    if command_name in WHOLE_CLIP_IN_MEMORY:
+        frames = media_info['duration'] * media_info['fps']
+    else:
+        frames = 60
+    memory_mb = 100 + frame_mb * frames
+    return cost_seconds, memory_mb
+
+def get_output_count(command_name, args):
+    """Number of outputs a fan-out command will encode from its arguments."""
+    if command_name == 'quality' and args:
+        return max(1, min(len([value for value in str(args[0]).split(',') if value]), FANOUT_MAX_OUTPUTS))
+    if command_name == 'togif' and 'mp4' in (str(value).lower() for value in args):
+        return 2
+    return 1
+
+def record_runtime(command_name, media_info, runtime, output_count=1):
+    """Moves the command's cost towards the measured encode time and saves the model."""
+    if command_name not in command_costs or media_info is None:
+        return
+    workload = get_workload(media_info) * output_count
+    if workload <= 0:
+        return
+    command_costs[command_name] = 0.8 * command_costs[command_name] + 0.2 * (runtime / workload)
+    save_cost_model()
+
+async def run_encode(ctx, func, *args, preview=False, **kwargs):
+    """
+    Runs a blocking encode off the event loop and adds its duration to the job's measured cost.
+
+    Preview encodes are charged separately, since they run alongside the full render and slow it down.
+    """
+    start = time.monotonic()
+    try:
+        return await asyncio.to_thread(func, *args, **kwargs)
+    finally:
+        field = 'preview_seconds' if preview else 'encode_seconds'
+        setattr(ctx, field, getattr(ctx, field, 0.0) + time.monotonic() - start)
+
+# Create a decorator that prices a command and only runs it if the budgets can pay for it
+def with_admission():
+    def decorator(func):
+        @wraps(func)
+        async def wrapped(ctx, *args, **kwargs):
+            user = ctx.author.mention
+            command_name = ctx.command.name
+
+            media_info = None
+            if command_name not in FIXED_COMMAND_COSTS:
+                attachment = await get_video_or_image_from_message_or_history(ctx)
+                if attachment is not None:
+                    source = attachment.path if isinstance(attachment, RetainedOutput) else attachment.url
+                    try:
+                        media_info = await asyncio.to_thread(probe_media, source)
+                        media_info['image'] = is_image(attachment.filename)
+                    except Exception as e:
+                        print(f"ffprobe error: {e}")
+                ctx.media_info = media_info
+
+            cost_seconds, memory_mb = estimate_job(command_name, media_info)
+            # Fan-out jobs decode once but pay for every extra encode
+            output_count = get_output_count(command_name, args)
+            cost_seconds *= output_count
+
+            # A preview renders at the same time as the full job, so it adds to both budgets
+            preview_plan = plan_preview(command_name, media_info)
+            if preview_plan is not None:
+                cost_seconds += preview_plan[1]
+                memory_mb += preview_plan[2]
+
+            if memory_mb > MAX_JOB_MEMORY_MB:
+                await ctx.reply(f"❌ **Error**: {user}, this file is too big for `{command_name}` (needs ~{round(memory_mb)} MB). Try a shorter or smaller clip.")
+                return
+
+            buckets = get_buckets(ctx)
+            for scope, bucket in buckets:
+                if cost_seconds > bucket.capacity:
+                    await ctx.reply(f"❌ **Error**: {user}, this job is too expensive (~{round(cost_seconds)} encode-seconds, {scope} budget is {bucket.capacity}). Try a shorter or smaller clip.")
+                    return
+
+            retry_after = max(bucket.wait_time(cost_seconds) for _, bucket in buckets)
+            if retry_after > 0:
+                await ctx.reply(f"⏳ **Cooldown**: Please wait {round(retry_after, 1)} seconds.")
+                return
+
+            for _, bucket in buckets:
+                bucket.tokens -= cost_seconds
+                bucket.in_flight += 1
+
+            # Only the encodes are timed, not downloads, uploads or early returns
+            ctx.encode_seconds = 0.0
+            ctx.preview_seconds = 0.0
+            ctx.output_posted = False
+            try:
+                result = await func(ctx, *args, **kwargs)
+            finally:
+                # Settle the difference between the estimate and what the job really cost,
+                # jobs that stopped before encoding or posting anything get the estimate back
+                spent_seconds = ctx.encode_seconds + ctx.preview_seconds
+                for _, bucket in buckets:
+                    if spent_seconds > 0:
+                        bucket.tokens -= spent_seconds - cost_seconds
+                    elif not ctx.output_posted:
+                        bucket.tokens += cost_seconds
+                    bucket.in_flight -= 1
+
+            # Only jobs that got as far as posting their output calibrate the model, and not when a
+            # preview competed with the full render for the CPU and inflated its time
+            if ctx.output_posted and ctx.encode_seconds > 0 and ctx.preview_seconds == 0:
+                record_runtime(command_name, media_info, ctx.encode_seconds, output_count)
+            return result
+        return wrapped
+    return decorator
+
+# Progressive delivery: slow jobs post a low-res, low-fps, ultrafast preview first and
+# edit the reply in place once the full render is done. Both renders share the
+# downloaded input, the admission probe and any random choices the command made.
+PROGRESSIVE_MIN_ENCODE_SECONDS = config.get('progressive_min_encode_seconds', 8)
+PREVIEW_LATENCY_TARGET_SECONDS = config.get('preview_latency_target_seconds', 3)
+PROGRESSIVE_COMMANDS = ('reverse', 'ytp', 'stutter', 'togif')
+PREVIEW_HEIGHTS = (360, 240, 144)
+PREVIEW_FPS = 12
+PREVIEW_ENCODE_OPTIONS = {'preset': 'ultrafast', 'crf': 32}
+
+def plan_preview(command_name, media_info):
+    """
+    Decides whether a job gets a preview and picks the largest preview size whose estimated cost fits in the latency target.
+
+    :return: (preview filter, estimated preview encode-seconds, estimated preview memory in MB), or None for no preview.
+    """
+    if command_name not in PROGRESSIVE_COMMANDS or media_info is None or media_info.get('image'):
+        return None
+    cost_seconds, memory_mb = estimate_job(command_name, media_info)
+    if cost_seconds < PROGRESSIVE_MIN_ENCODE_SECONDS:
+        return None
+
+    height = media_info['height'] or PREVIEW_HEIGHTS[-1]
+    fps_ratio = min(1.0, PREVIEW_FPS / media_info['fps']) if media_info['fps'] else 1.0
+    for preview_height in PREVIEW_HEIGHTS:
+        scale_ratio = min(1.0, preview_height / height) ** 2
+        if cost_seconds * scale_ratio * fps_ratio <= PREVIEW_LATENCY_TARGET_SECONDS:
+            break
+
+    # Whole-clip filters buffer fewer, smaller frames; the others keep the same number of smaller frames
+    frame_ratio = scale_ratio * fps_ratio if command_name in WHOLE_CLIP_IN_MEMORY else scale_ratio
+    preview_memory_mb = 100 + (memory_mb - 100) * frame_ratio
+    preview_filter = f"scale=-2:'min({preview_height},ih)',fps={PREVIEW_FPS}"
+    return preview_filter, cost_seconds * scale_ratio * fps_ratio, preview_memory_mb
+
+def get_preview_settings(preview_filter):
+    """Returns (filter prefix, extra encode options) for a render, empty for the full render."""
+    if preview_filter is None:
+        return "", {}
+    return f"{preview_filter},", PREVIEW_ENCODE_OPTIONS
+
+def to_ffmpeg_args(options):
+    """Turns a dict of ffmpeg options into command line arguments."""
+    return [arg for key, value in options.items() for arg in (f"-{key}", str(value))]
+
+async def post_full_render(ctx, content, output_paths, message=None):
+    """Posts the full render, editing the preview message in place if there is one."""
+    user = ctx.author.mention
+
+    # Check size of the outputs, extra outputs that don't fit in the upload are left out
+    postable, skipped = split_postable_outputs(output_paths)
+    if output_paths[0] in skipped:
+        error = f"{user}, the edited video exceeds the {MAX_FILE_SIZE_MB} MB limit!"
+        if message is not None:
+            await message.edit(content=f"{content} (preview only, {error})")
+        else:
+            await ctx.reply(error)
+        return None
+
+    if skipped:
+        left_out = ', '.join(os.path.splitext(path)[1].lstrip('.').upper() for path in skipped)
+        content += f" ({left_out} left out, over the {MAX_FILE_SIZE_MB} MB limit)"
+
+    if message is None:
+        return await reply_with_output(ctx, content, [(path, None) for path in postable])
+
+    message = await message.edit(content=content, attachments=[discord.File(path) for path in postable])
+    ctx.output_posted = True
+    await retain_output(message, postable)
+    return message
+
+async def reply_progressively(ctx, content, render, output_path, extra_outputs=()):
+    """
+    Renders an output and replies with it, posting a quick preview first if the job is slow.
+
+    :param render: Blocking function render(output_path, preview_filter) that writes the output,
+                   preview_filter is None for the full render or a filter to put in front of the command's own.
+    :param output_path: Where the full render is written, the preview goes next to it.
+    :param extra_outputs: Other paths the full render writes, posted along with output_path.
+    :return: The reply message, or None if the output was too big to post or failed after the preview.
+    """
+    user = ctx.author.mention
+    preview_plan = plan_preview(ctx.command.name, getattr(ctx, 'media_info', None))
+    output_paths = [output_path, *extra_outputs]
+
+    if preview_plan is None:
+        await run_encode(ctx, render, output_path, None)
+        return await post_full_render(ctx, content, output_paths)
+
+    root, extension = os.path.splitext(output_path)
+    preview_path = f'{root}_preview{extension}'
+    full_task = asyncio.ensure_future(run_encode(ctx, render, output_path, None))
+    preview_task = asyncio.ensure_future(run_encode(ctx, render, preview_path, preview_plan[0], preview=True))
+
+    try:
+        done, _ = await asyncio.wait([full_task, preview_task], return_when=asyncio.FIRST_COMPLETED)
+        if full_task in done:
+            # The full render won the race, post it right away without waiting for the preview
+            await full_task
+            return await post_full_render(ctx, content, output_paths)
+
+        message = None
+        try:
+            await preview_task
+            message = await reply_with_output(ctx, f"{content} (preview, full quality on the way)", preview_path, preview=True)
+        except Exception as e:
+            print(f"preview error: {e}")
+
+        try:
+            await full_task
+        except Exception as e:
+            if message is None:
+                raise
+            # The preview is already up, so report the failure on it instead of in a second message
+            print(f"ffmpeg error: {e}")
+            await message.edit(content=f"{content} (preview only, {user}, something went wrong with the full quality render!)")
+            return None
+
+        return await post_full_render(ctx, content, output_paths, message)
+    finally:
+        # Don't leave the preview writing into a temp dir that's about to be removed
+        await asyncio.gather(preview_task, return_exceptions=True)
+
 # Event handler
 @bot.event
 async def on_ready():
     print('Bot ready!')
+    print(get_shard_memory_report())
+
+@bot.event
+async def on_shard_ready(shard_id):
+    print(f'Shard {shard_id} ready!')
     
 # Event to print received command
 @bot.event
@@ -142,9 +958,9 @@ async def run_ffmpeg(command):
     )
     await process.communicate()
 
-# Reverse video command with cooldown
+# Reverse video command
 @bot.command()
-@commands.cooldown(1, 5, commands.BucketType.channel)  # Cooldown of 10 seconds per user
+@with_admission()
 @with_typing()
 async def reverse(ctx):
     """Reverses the video."""
@@ -177,23 +993,21 @@ async def reverse(ctx):
     # Generate a unique filename for the output to avoid conflicts
     unique_filename = f'output_{uuid.uuid4().hex}.mp4'
     output_video = os.path.join(temp_dir, unique_filename)
-    ffmpeg.input(video_path).output(output_video, vf='reverse', af='areverse').run()
 
-    # Check size of the output video
-    if os.path.getsize(output_video) > MAX_FILE_SIZE_MB * 1024 * 1024:
-        await ctx.reply(f"{user}, the edited video exceeds the {MAX_FILE_SIZE_MB} MB limit!")
-        cleanup_temp_dir(temp_dir)
-        return
+    def render(output_path, preview_filter):
+        prefix, options = get_preview_settings(preview_filter)
+        ffmpeg.input(video_path).output(output_path, vf=f'{prefix}reverse', af='areverse', **options).run(quiet=True, overwrite_output=True)
 
     random_message = get_random_message()
-    await ctx.reply(f"{random_message} || {user} [bedrock]", file=discord.File(output_video))
-
-    # Cleanup
-    cleanup_temp_dir(temp_dir)
+    try:
+        await reply_progressively(ctx, f"{random_message} || {user} [bedrock]", render, output_video)
+    finally:
+        # Cleanup
+        cleanup_temp_dir(temp_dir)
 
 # Speed change command
 @bot.command()
-@commands.cooldown(1, 5, commands.BucketType.channel)  # Cooldown of 10 seconds per user
+@with_admission()
 @with_typing()
 async def speed(ctx, factor: float):
     """Changes the video speed."""
@@ -226,7 +1040,7 @@ async def speed(ctx, factor: float):
     # Generate a unique filename for the output to avoid conflicts
     unique_filename = f'output_{uuid.uuid4().hex}.mp4'
     output_video = os.path.join(temp_dir, unique_filename)
-    ffmpeg.input(video_path).output(output_video, vf=f"setpts={1/factor}*PTS", af=f"atempo={factor}").run()
+    await run_encode(ctx, ffmpeg.input(video_path).output(output_video, vf=f"setpts={1/factor}*PTS", af=f"atempo={factor}").run)
 
     # Check size of the output video
     if os.path.getsize(output_video) > MAX_FILE_SIZE_MB * 1024 * 1024:
@@ -235,13 +1049,13 @@ async def speed(ctx, factor: float):
         return
 
     random_message = get_random_message()
-    await ctx.reply(f"{random_message} || {user} [bedrock]", file=discord.File(output_video))
+    await reply_with_output(ctx, f"{random_message} || {user} [bedrock]", output_video)
 
     # Cleanup
     cleanup_temp_dir(temp_dir)
 
 @bot.command()
-@commands.cooldown(1, 5, commands.BucketType.channel)
+@with_admission()
 @with_typing()
 async def pitch(ctx, pitch_value: float):
     """
@@ -275,10 +1089,10 @@ async def pitch(ctx, pitch_value: float):
         # Run FFmpeg with the rubberband filter for pitch shifting without speed change
         # The rubberband filter accepts a pitch shift ratio, where 1.0 is the original pitch
         # Pitch values greater than 1 increase the pitch, less than 1 decrease it
-        ffmpeg.input(file_path).output(
+        await run_encode(ctx, ffmpeg.input(file_path).output(
             output_file,
             af=f"rubberband=pitch={pitch_value}"
-        ).run(quiet=True, overwrite_output=True)
+        ).run, quiet=True, overwrite_output=True)
         
     except Exception as e:
         print(f"ffmpeg error: {e}")
@@ -287,24 +1101,32 @@ async def pitch(ctx, pitch_value: float):
         return
 
     random_message = get_random_message()
-    await ctx.reply(f"{random_message} || {user} [bedrock]", file=discord.File(output_file))
+    await reply_with_output(ctx, f"{random_message} || {user} [bedrock]", output_file)
 
     cleanup_temp_dir(temp_dir)
 
 # Command to change the quality of a video
 @bot.command()
-@commands.cooldown(1, 5, commands.BucketType.channel)
+@with_admission()
 @with_typing()
-async def quality(ctx, quality: int):
-    """Changes the quality of the video (1 being best, 100 being worst)."""
+async def quality(ctx, quality: str):
+    """Changes the quality of the video (1 being best, 100 being worst). Several comma-separated levels (e.g. 20,50,90) are rendered from one decode."""
     user = ctx.author.mention
-    temp_dir = create_temp_dir()
+
+    try:
+        qualities = [int(value) for value in quality.split(',') if value]
+    except ValueError:
+        await ctx.reply(f"{user}, please provide valid numbers for quality.")
+        return
+
+    if not qualities or len(qualities) > FANOUT_MAX_OUTPUTS:
+        await ctx.reply(f"{user}, please provide between 1 and {FANOUT_MAX_OUTPUTS} quality levels.")
+        return
 
     # Limit quality values between 1 and 100
-    quality = max(1, min(quality, 100))
+    qualities = [max(1, min(value, 100)) for value in qualities]
 
-    # Convert to CRF value (0-51 scale for FFmpeg)
-    crf_value = (quality - 1) * (51 / 99)
+    temp_dir = create_temp_dir()
 
     attachment = await get_video_or_image_from_message_or_history(ctx)
     if attachment is None:
@@ -323,29 +1145,80 @@ async def quality(ctx, quality: int):
         cleanup_temp_dir(temp_dir)
         return
 
+    # Images are degraded in-process and re-encoded as JPEG in memory
+    if is_image(video.filename):
+        try:
+            image_bytes = await video.read()
+            renders = [([('quality', value)], 'JPEG') for value in qualities]
+            output_buffers = await run_encode(ctx, apply_image_effects_fanout, image_bytes, renders)
+        except Exception as e:
+            print(f"image error: {e}")
+            await ctx.reply(f"{user}, something went wrong with the image processing!")
+            cleanup_temp_dir(temp_dir)
+            return
+
+        # Post as many outputs as fit in one upload, and say which ones didn't
+        outputs = [(buffer, f'output_q{value}_{uuid.uuid4().hex}.jpg') for buffer, value in zip(output_buffers, qualities)]
+        postable, skipped = split_postable_outputs(outputs, get_size=lambda output: output[0].getbuffer().nbytes)
+        if not postable:
+            await ctx.reply(f"{user}, the edited image exceeds the {MAX_FILE_SIZE_MB} MB limit!")
+            cleanup_temp_dir(temp_dir)
+            return
+
+        random_message = get_random_message()
+        content = f"{random_message} || {user} [bedrock]"
+        skipped_levels = [str(value) for value, output in zip(qualities, outputs) if output in skipped]
+        if skipped_levels:
+            content += f" (quality {', '.join(skipped_levels)} left out, over the {MAX_FILE_SIZE_MB} MB limit)"
+        await reply_with_output(ctx, content, postable)
+        cleanup_temp_dir(temp_dir)
+        return
+
     await video.save(video_path)
 
-    # Generate a unique filename for the output
-    unique_filename = f'output_{uuid.uuid4().hex}.mp4'
-    output_video = os.path.join(temp_dir, unique_filename)
+    # One output per quality level, all encoded from a single decode
+    outputs = []
+    for value in qualities:
+        # Convert to CRF value (0-51 scale for FFmpeg)
+        crf_value = (value - 1) * (51 / 99)
+        output_video = os.path.join(temp_dir, f'output_q{value}_{uuid.uuid4().hex}.mp4')
+        outputs.append((output_video, None, ["-crf", str(crf_value)], True))
 
     # Run ffmpeg to change video quality
     try:
-        ffmpeg.input(video_path).output(output_video, crf=crf_value).run(quiet=True, overwrite_output=True)
+        await run_encode(
+            ctx,
+            subprocess.run,
+            build_fanout_command(video_path, outputs),
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
     except Exception as e:
         print(f"ffmpeg error: {e}")
         await ctx.reply(f"{user}, something went wrong with the video processing!")
         cleanup_temp_dir(temp_dir)
         return
 
+    # Post as many outputs as fit in one upload, and say which ones didn't
+    postable, skipped = split_postable_outputs([path for path, _, _, _ in outputs])
+    skipped_levels = [str(value) for value, (path, _, _, _) in zip(qualities, outputs) if path in skipped]
+    if not postable:
+        await ctx.reply(f"{user}, the edited video exceeds the {MAX_FILE_SIZE_MB} MB limit!")
+        cleanup_temp_dir(temp_dir)
+        return
+
     random_message = get_random_message()
-    await ctx.reply(f"{random_message} || {user} [bedrock]", file=discord.File(output_video))
+    content = f"{random_message} || {user} [bedrock]"
+    if skipped_levels:
+        content += f" (quality {', '.join(skipped_levels)} left out, over the {MAX_FILE_SIZE_MB} MB limit)"
+    await reply_with_output(ctx, content, [(path, None) for path in postable])
 
     cleanup_temp_dir(temp_dir)
 
 # Command to change the volume of a video/audio
 @bot.command()
-@commands.cooldown(1, 5, commands.BucketType.channel)
+@with_admission()
 @with_typing()
 async def volume(ctx, volume_factor: float):
     """Changes the volume of the video/audio (e.g., 1.0 for normal, 0.5 for half, 2.0 for double)."""
@@ -377,7 +1250,7 @@ async def volume(ctx, volume_factor: float):
 
     # Run ffmpeg to change the volume
     try:
-        ffmpeg.input(video_path).output(output_video, af=f'volume={volume_factor}').run(quiet=True, overwrite_output=True)
+        await run_encode(ctx, ffmpeg.input(video_path).output(output_video, af=f'volume={volume_factor}').run, quiet=True, overwrite_output=True)
     except Exception as e:
         print(f"ffmpeg error: {e}")
         await ctx.reply(f"{user}, something went wrong with the video processing!")
@@ -385,13 +1258,13 @@ async def volume(ctx, volume_factor: float):
         return
 
     random_message = get_random_message()
-    await ctx.reply(f"{random_message} || {user} [bedrock]", file=discord.File(output_video))
+    await reply_with_output(ctx, f"{random_message} || {user} [bedrock]", output_video)
 
     cleanup_temp_dir(temp_dir)
 
 # Command to download a YouTube video at 480p
 @bot.command()
-@commands.cooldown(1, 5, commands.BucketType.channel)
+@with_admission()
 @with_typing()
 async def download(ctx, url: str):
     """Downloads a YouTube video at 480p."""
@@ -416,7 +1289,7 @@ async def download(ctx, url: str):
 
         # Send the video to the Discord channel
         random_message = get_random_message()
-        await ctx.reply(f"{random_message} || {user} [bedrock]", file=discord.File(video_path))
+        await reply_with_output(ctx, f"{random_message} || {user} [bedrock]", video_path)
 
     except Exception as e:
         print(f"yt-dlp error: {e}")
@@ -427,7 +1300,7 @@ async def download(ctx, url: str):
 
 
 @bot.command()
-@commands.cooldown(1, 5, commands.BucketType.channel)
+@with_admission()
 @with_typing()
 async def fps(ctx, fps_value: int):
     """Changes the frames per second of the video without changing speed."""
@@ -459,7 +1332,7 @@ async def fps(ctx, fps_value: int):
     # Run ffmpeg to change the FPS without changing speed
     try:
         # Using -filter:v to change the FPS
-        ffmpeg.input(video_path).output(output_video, **{'vf': f'fps={fps_value}'}).run(quiet=True, overwrite_output=True)
+        await run_encode(ctx, ffmpeg.input(video_path).output(output_video, **{'vf': f'fps={fps_value}'}).run, quiet=True, overwrite_output=True)
     except Exception as e:
         print(f"ffmpeg error: {e}")
         await ctx.reply(f"{user}, something went wrong with the video processing!")
@@ -467,12 +1340,12 @@ async def fps(ctx, fps_value: int):
         return
 
     random_message = get_random_message()
-    await ctx.reply(f"{random_message} || {user} [bedrock]", file=discord.File(output_video))
+    await reply_with_output(ctx, f"{random_message} || {user} [bedrock]", output_video)
 
     cleanup_temp_dir(temp_dir)
 
 @bot.command()
-@commands.cooldown(1, 5, commands.BucketType.channel)
+@with_admission()
 @with_typing()
 async def repu(ctx, seconds: str):
     """Repeats the video until a certain amount of seconds."""
@@ -485,6 +1358,10 @@ async def repu(ctx, seconds: str):
         await ctx.reply(f"{user}, please provide a valid number for seconds.")
         return
 
+    if not 1 <= seconds <= MAX_REPEAT_SECONDS:
+        await ctx.reply(f"{user}, seconds must be between 1 and {MAX_REPEAT_SECONDS}.")
+        return
+
     temp_dir = create_temp_dir()
 
     attachment = await get_video_or_image_from_message_or_history(ctx)
@@ -510,7 +1387,10 @@ async def repu(ctx, seconds: str):
     output_video = os.path.join(temp_dir, unique_filename)
 
     try:
-        ffmpeg.input(video_path, stream_loop=-1).output(output_video, t=seconds).run(quiet=True, overwrite_output=True)
+        # Encode a single loop iteration, then repeat it with stream copy so the cost doesn't scale with length
+        unit_video = os.path.join(temp_dir, f'unit_{uuid.uuid4().hex}.mp4')
+        await run_encode(ctx, ffmpeg.input(video_path).output(unit_video, vcodec='libx264', acodec='aac').run, quiet=True, overwrite_output=True)
+        await run_encode(ctx, loop_to_length, unit_video, seconds, output_video)
     except Exception as e:
         print(f"ffmpeg error: {e}")
         await ctx.reply(f"{user}, something went wrong with the video processing!")
@@ -518,13 +1398,13 @@ async def repu(ctx, seconds: str):
         return
 
     random_message = get_random_message()
-    await ctx.reply(f"{random_message} || {user} [bedrock]", file=discord.File(output_video))
+    await reply_with_output(ctx, f"{random_message} || {user} [bedrock]", output_video)
 
     cleanup_temp_dir(temp_dir)
 
 # Command to change the hue of the video
 @bot.command()
-@commands.cooldown(1, 5, commands.BucketType.channel)
+@with_admission()
 @with_typing()
 async def hue(ctx, hue_value: float):
     """Changes the hue of the image/video."""
@@ -554,16 +1434,29 @@ async def hue(ctx, hue_value: float):
         cleanup_temp_dir(temp_dir)
         return
 
+    # Images are handled in-process without touching the disk
+    if is_image(attachment.filename):
+        try:
+            image_bytes = await attachment.read()
+            output_buffer = await run_encode(ctx, apply_image_effects, image_bytes, [('hue', hue_value)])
+        except Exception as e:
+            print(f"image error: {e}")
+            await ctx.reply(f"❌ **Error**: Something went wrong. ```{str(e)}```")
+            cleanup_temp_dir(temp_dir)
+            return
+
+        random_message = get_random_message()
+        await reply_with_output(ctx, f"{random_message} || {user} [bedrock]", output_buffer, filename=f'output_{uuid.uuid4().hex}.png')
+        cleanup_temp_dir(temp_dir)
+        return
+
     await attachment.save(file_path)
 
-    unique_filename = f'output_{uuid.uuid4().hex}.png' if attachment.filename.endswith(('.png', '.jpg', '.jpeg')) else f'output_{uuid.uuid4().hex}.mp4'
+    unique_filename = f'output_{uuid.uuid4().hex}.mp4'
     output_file = os.path.join(temp_dir, unique_filename)
 
     try:
-        if attachment.filename.endswith(('.png', '.jpg', '.jpeg')):
-            ffmpeg.input(file_path).output(output_file, vf=f'hue=h={hue_value}').run(quiet=True, overwrite_output=True)
-        else:
-            ffmpeg.input(file_path).output(output_file, vf=f'hue=h={hue_value}').run(quiet=True, overwrite_output=True)
+        await run_encode(ctx, ffmpeg.input(file_path).output(output_file, vf=f'hue=h={hue_value}').run, quiet=True, overwrite_output=True)
     except Exception as e:
         print(f"ffmpeg error: {e}")
         await ctx.reply(f"❌ **Error**: Something went wrong. ```{str(e)}```")
@@ -571,12 +1464,12 @@ async def hue(ctx, hue_value: float):
         return
 
     random_message = get_random_message()
-    await ctx.reply(f"{random_message} || {user} [bedrock]", file=discord.File(output_file))
+    await reply_with_output(ctx, f"{random_message} || {user} [bedrock]", output_file)
 
     cleanup_temp_dir(temp_dir)
 
 @bot.command()
-@commands.cooldown(1, 5, commands.BucketType.channel)
+@with_admission()
 @with_typing()
 async def tovid(ctx):
     """Converts an image to a 10-second MP4 video. Ignores if the file is already a video."""
@@ -602,7 +1495,10 @@ async def tovid(ctx):
     output_file = os.path.join(temp_dir, unique_filename)
 
     try:
-        ffmpeg.input(file_path, loop=1, t=10).output(output_file, vcodec='libx264').run(quiet=True, overwrite_output=True)
+        # Encode one second of the still as a single GOP, then repeat it with stream copy
+        unit_file = os.path.join(temp_dir, f'unit_{uuid.uuid4().hex}.mp4')
+        await run_encode(ctx, ffmpeg.input(file_path, loop=1, t=1, framerate=25).output(unit_file, vcodec='libx264', tune='stillimage', g=25).run, quiet=True, overwrite_output=True)
+        await run_encode(ctx, loop_to_length, unit_file, 10, output_file)
     except Exception as e:
         print(f"ffmpeg error: {e}")
         await ctx.reply(f"❌ **Error**: Something went wrong. ```{str(e)}```")
@@ -610,16 +1506,22 @@ async def tovid(ctx):
         return
 
     random_message = get_random_message()
-    await ctx.reply(f"{random_message} || {user} [bedrock]", file=discord.File(output_file))
+    await reply_with_output(ctx, f"{random_message} || {user} [bedrock]", output_file)
 
     cleanup_temp_dir(temp_dir)
 
 @bot.command()
-@commands.cooldown(1, 5, commands.BucketType.channel)
+@with_admission()
 @with_typing()
-async def togif(ctx):
-    """Converts an image or video to a GIF."""
+async def togif(ctx, *formats: str):
+    """Converts an image or video to a GIF. Add `mp4` to also get an MP4 rendered from the same decode."""
     user = ctx.author.mention
+
+    unknown_formats = [value for value in formats if value.lower() not in TOGIF_EXTRA_FORMATS]
+    if unknown_formats:
+        await ctx.reply(f"{user}, unknown format `{unknown_formats[0]}`, only {', '.join(f'`{value}`' for value in TOGIF_EXTRA_FORMATS)} can be added.")
+        return
+
     temp_dir = create_temp_dir()
 
     attachment = await get_video_or_image_from_message_or_history(ctx)
@@ -627,28 +1529,60 @@ async def togif(ctx):
         await ctx.reply(f"❌ **Error**: {user}, no valid file found!")
         return
 
+    # A single image becomes a one-frame GIF, no need for ffmpeg
+    if is_image(attachment.filename):
+        if formats:
+            await ctx.reply(f"{user}, extra formats only work on videos, use `tovid` to turn an image into an MP4.")
+            cleanup_temp_dir(temp_dir)
+            return
+
+        try:
+            image_bytes = await attachment.read()
+            output_buffer = await run_encode(ctx, apply_image_effects, image_bytes, [], 'GIF')
+        except Exception as e:
+            print(f"image error: {e}")
+            await ctx.reply(f"❌ **Error**: Something went wrong. ```{str(e)}```")
+            cleanup_temp_dir(temp_dir)
+            return
+
+        random_message = get_random_message()
+        await reply_with_output(ctx, f"{random_message} || {user} [bedrock]", output_buffer, filename=f'output_{uuid.uuid4().hex}.gif')
+        cleanup_temp_dir(temp_dir)
+        return
+
     file_path = os.path.join(temp_dir, attachment.filename)
     await attachment.save(file_path)
 
-    # Convert to GIF
+    # Convert to GIF, plus an MP4 from the same decode if asked for
     unique_filename = f'output_{uuid.uuid4().hex}.gif'
     output_file = os.path.join(temp_dir, unique_filename)
+    extra_outputs = []
+    if 'mp4' in (value.lower() for value in formats):
+        extra_outputs.append(os.path.join(temp_dir, f'output_{uuid.uuid4().hex}.mp4'))
+
+    def render(output_path, preview_filter):
+        outputs = [(output_path, "fps=10", ["-f", "gif"], False)]
+        # The preview only shows the GIF
+        if preview_filter is None:
+            outputs += [(path, None, [], True) for path in extra_outputs]
+        subprocess.run(
+            build_fanout_command(file_path, outputs, video_filter=preview_filter),
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
 
+    random_message = get_random_message()
     try:
-        ffmpeg.input(file_path).output(output_file, vf="fps=10", format='gif').run(quiet=True, overwrite_output=True)
+        await reply_progressively(ctx, f"{random_message} || {user} [bedrock]", render, output_file, extra_outputs)
     except Exception as e:
         print(f"ffmpeg error: {e}")
         await ctx.reply(f"❌ **Error**: Something went wrong. ```{str(e)}```")
+    finally:
         cleanup_temp_dir(temp_dir)
-        return
-
-    random_message = get_random_message()
-    await ctx.reply(f"{random_message} || {user} [bedrock]", file=discord.File(output_file))
-
-    cleanup_temp_dir(temp_dir)
 
 @bot.command()
-@commands.cooldown(1, 5, commands.BucketType.channel)
+@with_admission()
 @with_typing()
 async def ytp(ctx):
     """Applies a 'YouTube Poop' effect: randomly reversing and un-reversing sections of a video, including the audio."""
@@ -666,48 +1600,51 @@ async def ytp(ctx):
     unique_filename = f'output_{uuid.uuid4().hex}.mp4'
     output_file = os.path.join(temp_dir, unique_filename)
 
-    # Generate random reverse/unreverse points in the video
-    duration = get_video_duration(file_path)  # Helper function to get the video duration using ffmpeg
+    # Generate random reverse/unreverse points in the video, reusing the admission probe if there was one
+    media_info = getattr(ctx, 'media_info', None)
+    duration = media_info['duration'] if media_info else get_video_duration(file_path)
     reverse_points = generate_random_sections(duration, 3)  # Generates 3 random sections for reversing
 
-    # Construct the filter_complex for both video and audio
-    filter_complex = ""
-    for i, (start, end) in enumerate(reverse_points):
-        filter_complex += (
-            f"[0:v]trim=start={start}:end={end},setpts=PTS-STARTPTS,reverse[v{i}]; "
-            f"[0:a]atrim=start={start}:end={end},asetpts=PTS-STARTPTS,areverse[a{i}]; "
-        )
+    def render(output_path, preview_filter):
+        prefix, options = get_preview_settings(preview_filter)
 
-    # Concatenate reversed sections
-    filter_complex += "".join(f"[v{i}]" for i in range(len(reverse_points))) + f"concat=n={len(reverse_points)}:v=1[outv]; "
-    filter_complex += "".join(f"[a{i}]" for i in range(len(reverse_points))) + f"concat=n={len(reverse_points)}:v=0:a=1[outa]"
+        # Construct the filter_complex for both video and audio
+        filter_complex = ""
+        for i, (start, end) in enumerate(reverse_points):
+            filter_complex += (
+                f"[0:v]{prefix}trim=start={start}:end={end},setpts=PTS-STARTPTS,reverse[v{i}]; "
+                f"[0:a]atrim=start={start}:end={end},asetpts=PTS-STARTPTS,areverse[a{i}]; "
+            )
+
+        # Concatenate reversed sections
+        filter_complex += "".join(f"[v{i}]" for i in range(len(reverse_points))) + f"concat=n={len(reverse_points)}:v=1[outv]; "
+        filter_complex += "".join(f"[a{i}]" for i in range(len(reverse_points))) + f"concat=n={len(reverse_points)}:v=0:a=1[outa]"
 
-    try:
         # Use ffmpeg to process both video and audio
         subprocess.run(
             [
-                "ffmpeg", "-i", file_path,
+                "ffmpeg", "-y", "-i", file_path,
                 "-filter_complex", filter_complex,
                 "-map", "[outv]", "-map", "[outa]",  # Map both video and audio streams
-                output_file
+                *to_ffmpeg_args(options),
+                output_path
             ],
             check=True,
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL
         )
+
+    random_message = get_random_message()
+    try:
+        await reply_progressively(ctx, f"{random_message} || {user} [bedrock]", render, output_file)
     except Exception as e:
         print(f"ffmpeg error: {e}")
         await ctx.reply(f"{user}, something went wrong with the video processing!")
+    finally:
         cleanup_temp_dir(temp_dir)
-        return
-
-    random_message = get_random_message()
-    await ctx.reply(f"{random_message} || {user} [bedrock]", file=discord.File(output_file))
-
-    cleanup_temp_dir(temp_dir)
 
 @bot.command()
-@commands.cooldown(1, 5, commands.BucketType.channel)
+@with_admission()
 @with_typing()
 async def stutter(ctx):
     """Applies a stuttering effect by repeating and scrambling short chunks of the video."""
@@ -725,8 +1662,9 @@ async def stutter(ctx):
     unique_filename = f'output_{uuid.uuid4().hex}.mp4'
     output_file = os.path.join(temp_dir, unique_filename)
 
-    # Get the video duration to create random sections
-    duration = get_video_duration(file_path)
+    # Get the video duration to create random sections, reusing the admission probe if there was one
+    media_info = getattr(ctx, 'media_info', None)
+    duration = media_info['duration'] if media_info else get_video_duration(file_path)
 
     # Step 1: Repeat a very short chunk (1-3 seconds)
     repeat_section = generate_random_sections(duration, 1, min_duration=1.0, max_duration=3.0)[0]
@@ -734,44 +1672,96 @@ async def stutter(ctx):
     # Step 2: Scramble very short 0.1 second chunks
     scramble_points = generate_random_sections(duration, 10, min_duration=0.1, max_duration=0.1)
 
-    # Create filter_complex for stuttering effect
-    filter_complex = (
-        f"[0:v]trim=start={repeat_section[0]}:end={repeat_section[1]},setpts=PTS-STARTPTS[vrepeat]; "
-        f"[0:a]atrim=start={repeat_section[0]}:end={repeat_section[1]},asetpts=PTS-STARTPTS[arepeat]; "
-    )
+    def render(output_path, preview_filter):
+        prefix, options = get_preview_settings(preview_filter)
 
-    for i, (start, end) in enumerate(scramble_points):
-        filter_complex += (
-            f"[0:v]trim=start={start}:end={end},setpts=PTS-STARTPTS[vscramble{i}]; "
-            f"[0:a]atrim=start={start}:end={end},asetpts=PTS-STARTPTS[ascramble{i}]; "
+        # Create filter_complex for stuttering effect
+        filter_complex = (
+            f"[0:v]{prefix}trim=start={repeat_section[0]}:end={repeat_section[1]},setpts=PTS-STARTPTS[vrepeat]; "
+            f"[0:a]atrim=start={repeat_section[0]}:end={repeat_section[1]},asetpts=PTS-STARTPTS[arepeat]; "
         )
 
-    # Concatenate repeat section and scrambled chunks
-    filter_complex += f"[vrepeat][arepeat]" + "".join(f"[vscramble{i}][ascramble{i}]" for i in range(len(scramble_points))) + f"concat=n={1+len(scramble_points)}:v=1:a=1[outv][outa]"
+        for i, (start, end) in enumerate(scramble_points):
+            filter_complex += (
+                f"[0:v]{prefix}trim=start={start}:end={end},setpts=PTS-STARTPTS[vscramble{i}]; "
+                f"[0:a]atrim=start={start}:end={end},asetpts=PTS-STARTPTS[ascramble{i}]; "
+            )
+
+        # Concatenate repeat section and scrambled chunks
+        filter_complex += f"[vrepeat][arepeat]" + "".join(f"[vscramble{i}][ascramble{i}]" for i in range(len(scramble_points))) + f"concat=n={1+len(scramble_points)}:v=1:a=1[outv][outa]"
 
-    try:
         # Use ffmpeg to apply the stutter effect
         subprocess.run(
             [
-                "ffmpeg", "-i", file_path,
+                "ffmpeg", "-y", "-i", file_path,
                 "-filter_complex", filter_complex,
                 "-map", "[outv]", "-map", "[outa]",  # Map both video and audio streams
-                output_file
+                *to_ffmpeg_args(options),
+                output_path
             ],
             check=True,
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL
         )
+
+    random_message = get_random_message()
+    try:
+        await reply_progressively(ctx, f"{random_message} || {user} [bedrock]", render, output_file)
     except Exception as e:
         print(f"ffmpeg error: {e}")
         await ctx.reply(f"{user}, something went wrong with the video processing!")
+    finally:
         cleanup_temp_dir(temp_dir)
+
+# Chains several image effects in one pass, e.g. &ovb edit hue=90 quality=50
+@bot.command()
+@with_admission()
+@with_typing()
+async def edit(ctx):
+    """Applies a chain of effects (hue, quality) to an image in the given order."""
+    user = ctx.author.mention
+
+    # Effects run in the order given and may repeat, e.g. hue=90 quality=50 hue=-90
+    try:
+        effects = [(name, float(value)) for name, value in parse_effects(ctx.message.content) if name in IMAGE_EFFECTS]
+    except ValueError:
+        await ctx.reply(f"{user}, please provide valid numbers for the effects.")
+        return
+
+    if not effects:
+        await ctx.reply(f"{user}, please provide effects like `hue=90 quality=50`.")
+        return
+
+    attachment = await get_video_or_image_from_message_or_history(ctx)
+    if attachment is None or not is_image(attachment.filename):
+        await ctx.reply(f"{user}, no valid image file found!")
+        return
+
+    if attachment.size > MAX_FILE_SIZE_MB * 1024 * 1024:
+        await ctx.reply(f"Error: File size exceeds {MAX_FILE_SIZE_MB} MB.")
+        return
+
+    # Degraded images go out as JPEG so the encode adds to the effect
+    output_format = 'JPEG' if any(name == 'quality' for name, _ in effects) else 'PNG'
+    extension = 'jpg' if output_format == 'JPEG' else 'png'
+
+    try:
+        image_bytes = await attachment.read()
+        output_buffer = await run_encode(ctx, apply_image_effects, image_bytes, effects, output_format)
+    except Exception as e:
+        print(f"image error: {e}")
+        await ctx.reply(f"❌ **Error**: Something went wrong. ```{str(e)}```")
         return
 
     random_message = get_random_message()
-    await ctx.reply(f"{random_message} || {user} [bedrock]", file=discord.File(output_file))
+    await reply_with_output(ctx, f"{random_message} || {user} [bedrock]", output_buffer, filename=f'output_{uuid.uuid4().hex}.{extension}')
 
-    cleanup_temp_dir(temp_dir)
+# Shows the memory report for the shards running in this process
+@bot.command()
+@with_admission()
+async def memory(ctx):
+    """Shows memory and cache usage per shard."""
+    await ctx.reply(f"```{get_shard_memory_report()}```")
 
 @bot.event
 async def on_command_error(ctx, error):